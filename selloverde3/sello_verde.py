@@ -1,28 +1,35 @@
 
 import streamlit as st
 import pandas as pd
-import json, os, uuid, zipfile
+import numpy as np
+import json, os, uuid, zipfile, sqlite3, hashlib, tempfile
+from bisect import bisect_left, bisect_right
+import importlib.util
+from contextlib import contextmanager
 from datetime import datetime
-import matplotlib.pyplot as plt
 import io
 
-# Optional PDF (reportlab)
+# Optional PDF (reportlab): only probed here; imported inside create_certificate_pdf.
+# matplotlib is likewise imported inside _plot_trend, so reruns that don't chart skip it
+REPORTLAB_AVAILABLE = importlib.util.find_spec("reportlab") is not None
+
+# Optional fast JSON (orjson); falls back to stdlib json
 try:
-    from reportlab.lib.pagesizes import letter
-    from reportlab.pdfgen import canvas
-    REPORTLAB_AVAILABLE = True
+    import orjson
+    ORJSON_AVAILABLE = True
 except Exception:
-    REPORTLAB_AVAILABLE = False
+    ORJSON_AVAILABLE = False
 
 st.set_page_config(page_title="Sello Verde · Domino's", page_icon="🌿", layout="wide")
 
 # Filenames (mismo nivel)
-DATA_FILE = "sello_data.json"
+DATA_FILE = "sello_data.json"  # legacy store: imported into DB_FILE on first run
+DB_FILE = "sello.db"
 CERT_FILE = "sello_certificados.json"
 EVID_DIR = "sello_evidencias"
 
 # ---------- CSS (estético A+B) ----------
-st.markdown("""
+CSS_BLOB = """
 <style>
 body { background: #f7f9fb; }
 [data-testid="stSidebar"] { background: linear-gradient(180deg,#ffffff,#f1fff1); }
@@ -32,45 +39,182 @@ div.stButton > button:first-child { background-color:#2d6a4f !important; color:w
 .kpi { background:#fff; padding:12px; border-radius:10px; box-shadow:0 4px 12px rgba(0,0,0,0.04); text-align:center; }
 .small { font-size:12px; color:#666; }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+# cache_resource replays the cached st.markdown on each rerun, so the style block
+# stays on the page without rebuilding / re-hashing the HTML every time
+@st.cache_resource(show_spinner=False)
+def _inject_css():
+    st.markdown(CSS_BLOB, unsafe_allow_html=True)
+
+_inject_css()
 
 # ---------- Helpers: files ----------
+def json_dumps(obj, indent=True):
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None)
+    return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False).encode("utf-8")
+
+def json_loads(raw):
+    return orjson.loads(raw) if ORJSON_AVAILABLE else json.loads(raw)
+
+def write_json_atomic(path, obj):
+    # write to a private temp file, fsync, then rename: a crash or power loss mid-write
+    # never leaves a truncated JSON, and concurrent sessions (threads) never share the temp
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd,"wb") as f:
+            f.write(json_dumps(obj))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+# ---------- Helpers: SQLite store (sedes + registros) ----------
+# one row per record, so add/edit/delete touch a single row instead of rewriting the whole JSON
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sedes (key TEXT PRIMARY KEY, nombre TEXT, municipio TEXT);
+CREATE TABLE IF NOT EXISTS records (id TEXT PRIMARY KEY, sede_key TEXT NOT NULL, month TEXT, json BLOB NOT NULL);
+CREATE INDEX IF NOT EXISTS records_sede ON records(sede_key);
+"""
+# edit path only: upsert keeps the rowid, so records stay in insertion order after an edit
+_UPSERT_RECORD = ("INSERT INTO records(id,sede_key,month,json) VALUES (?,?,?,?) "
+                  "ON CONFLICT(id) DO UPDATE SET sede_key=excluded.sede_key, month=excluded.month, json=excluded.json")
+
+@contextmanager
+def _db():
+    con = sqlite3.connect(DB_FILE)
+    try:
+        with con:  # commit on success, rollback on error
+            yield con
+    finally:
+        con.close()
+
+def _record_row(sede_key, rec):
+    return (rec["id"], sede_key, rec.get("month"), json_dumps(rec, indent=False))
+
+def _insert_record(con, sede_key, rec, retries=5):
+    # ids are short (8 chars) and records.id is a global key: on a clash with a record
+    # of any sede, re-key the new one instead of overwriting the existing row.
+    # Any other constraint failure (or too many clashes) is re-raised
+    for _ in range(retries):
+        try:
+            con.execute("INSERT INTO records(id,sede_key,month,json) VALUES (?,?,?,?)", _record_row(sede_key, rec))
+            return
+        except sqlite3.IntegrityError:
+            if con.execute("SELECT 1 FROM records WHERE id=?", (rec["id"],)).fetchone() is None:
+                raise
+            rec["id"] = str(uuid.uuid4())[:8]
+    con.execute("INSERT INTO records(id,sede_key,month,json) VALUES (?,?,?,?)", _record_row(sede_key, rec))
+
+@st.cache_resource(show_spinner=False)
 def ensure_files():
     if not os.path.exists(EVID_DIR):
         os.makedirs(EVID_DIR)
-    if not os.path.exists(DATA_FILE):
-        base = {
-            "sedes": {
-                "Domino_Miraflores": {"nombre":"Domino's - Miraflores","municipio":"Miraflores","registros":[]},
-                "Domino_SanIsidro": {"nombre":"Domino's - San Isidro","municipio":"San Isidro","registros":[]},
-                "Domino_LimaCentro": {"nombre":"Domino's - Lima Centro","municipio":"Lima","registros":[]}
-            }
-        }
-        with open(DATA_FILE,"w",encoding="utf-8") as f:
-            json.dump(base,f,indent=2,ensure_ascii=False)
+    with _db() as con:
+        con.executescript(_SCHEMA)
+        if con.execute("SELECT COUNT(*) FROM sedes").fetchone()[0] == 0:
+            if os.path.exists(DATA_FILE):
+                with open(DATA_FILE,"rb") as f:
+                    base = json_loads(f.read())
+            else:
+                base = {
+                    "sedes": {
+                        "Domino_Miraflores": {"nombre":"Domino's - Miraflores","municipio":"Miraflores","registros":[]},
+                        "Domino_SanIsidro": {"nombre":"Domino's - San Isidro","municipio":"San Isidro","registros":[]},
+                        "Domino_LimaCentro": {"nombre":"Domino's - Lima Centro","municipio":"Lima","registros":[]}
+                    }
+                }
+            for key,s in base["sedes"].items():
+                con.execute("INSERT INTO sedes(key,nombre,municipio) VALUES (?,?,?)", (key, s["nombre"], s["municipio"]))
+                for r in s["registros"]:
+                    _insert_record(con, key, r)
     if not os.path.exists(CERT_FILE):
-        with open(CERT_FILE,"w",encoding="utf-8") as f:
-            json.dump([],f,indent=2,ensure_ascii=False)
+        write_json_atomic(CERT_FILE, [])
+
+# parsed JSON cached per (path, mtime): reruns only re-read when the file changed
+@st.cache_data(show_spinner=False)
+def _load_json_cached(path, mtime):
+    with open(path,"rb") as f:
+        return json_loads(f.read())
+
+# rebuilds the {"sedes": {key: {..., "registros": [...]}}} shape; cached per DB mtime.
+# "by_id" indexes the same record objects (record ids are unique across sedes);
+# shared references survive the cache's copy, so edits through either view stay in sync
+@st.cache_data(show_spinner=False)
+def _load_db_cached(mtime):
+    by_id = {}
+    with _db() as con:
+        sedes = {key: {"nombre":nombre,"municipio":municipio,"registros":[]}
+                 for key,nombre,municipio in con.execute("SELECT key,nombre,municipio FROM sedes ORDER BY rowid")}
+        for key,raw in con.execute("SELECT sede_key,json FROM records ORDER BY rowid"):
+            rec = json_loads(raw)
+            sedes[key]["registros"].append(rec)
+            by_id[rec["id"]] = rec
+    # scores are stored on write; backfill records saved before that, in one vectorized pass
+    missing = [r for r in by_id.values() if "score" not in r]
+    for r,score in zip(missing, compute_scores_vec(missing).tolist()):
+        r["score"] = score
+    return {"sedes": sedes, "by_id": by_id}
 
 def load_data():
-    with open(DATA_FILE,"r",encoding="utf-8") as f:
-        return json.load(f)
-
-def save_data(d):
-    with open(DATA_FILE,"w",encoding="utf-8") as f:
-        json.dump(d,f,indent=2,ensure_ascii=False)
+    return _load_db_cached(os.path.getmtime(DB_FILE))
+
+def session_data():
+    # parsed data kept per session and mutated in place; only re-fetched (and the
+    # cache's copy paid for) when the DB changed, by this session or another one
+    mtime = os.path.getmtime(DB_FILE)
+    if st.session_state.get("_data_mtime") != mtime:
+        st.session_state["data"] = load_data()
+        st.session_state["_data_mtime"] = mtime
+    return st.session_state["data"]
+
+def insert_record(sede_key, rec):
+    # new records only; may change rec["id"] on a clash (see _insert_record)
+    with _db() as con:
+        _insert_record(con, sede_key, rec)
+    _load_db_cached.clear()
+
+def save_record(sede_key, rec):
+    with _db() as con:
+        con.execute(_UPSERT_RECORD, _record_row(sede_key, rec))
+    _load_db_cached.clear()
+
+def delete_record(rec_id):
+    with _db() as con:
+        con.execute("DELETE FROM records WHERE id=?", (rec_id,))
+    _load_db_cached.clear()
+
+# same layout as the legacy sello_data.json, for backups / external tools.
+# built only on request; one entry, so older snapshots don't pile up after each write
+@st.cache_data(show_spinner=False, max_entries=1)
+def _export_json_cached(mtime):
+    return json_dumps({"sedes": load_data()["sedes"]})
+
+def export_data_json():
+    return _export_json_cached(os.path.getmtime(DB_FILE))
 
 def load_certs():
-    with open(CERT_FILE,"r",encoding="utf-8") as f:
-        return json.load(f)
+    return _load_json_cached(CERT_FILE, os.path.getmtime(CERT_FILE))
 
 def save_certs(c):
-    with open(CERT_FILE,"w",encoding="utf-8") as f:
-        json.dump(c,f,indent=2,ensure_ascii=False)
+    write_json_atomic(CERT_FILE, c)
+    _load_json_cached.clear()
 
 # ---------- Scoring: extended ----------
 MAP_LVL = {"low":1.0, "medium":0.6, "high":0.2}
 DEFAULT_WEIGHTS = {"waste":0.20,"energy":0.15,"water":0.15,"recycle":0.15,"carbon":0.10,"oil":0.10,"hygiene":0.10}
+# threshold ladders: *_VAL[i] applies when the value falls in the i-th interval cut by *_TH.
+# scalar path looks the bucket up with bisect, vectorized path with np.searchsorted
+_ENERGY_TH, _ENERGY_VAL = (500, 1200), (1.0, 0.6, 0.2)     # kWh, buckets are x <= bound
+_WATER_TH, _WATER_VAL = (2000, 5000), (1.0, 0.6, 0.2)      # liters, <=
+_CARBON_TH, _CARBON_VAL = (500, 1200), (1.0, 0.6, 0.2)     # kgCO2, <=
+_RECYCLE_TH, _RECYCLE_VAL = (0.3, 0.6), (0.2, 0.6, 1.0)    # fraction, buckets are x >= bound
+_HYGIENE_TH, _HYGIENE_VAL = (0.7, 0.9), (0.2, 0.6, 1.0)    # fraction, >=
+_LEVEL_TH, _LEVELS = (41, 76), ("Bronce", "Plata", "Oro")  # score, >=
 
 def compute_score_full(rec, weights=None):
     if weights is None:
@@ -82,34 +226,26 @@ def compute_score_full(rec, weights=None):
     if e_val is None:
         e = MAP_LVL.get(rec.get("energy_level","medium"),0.6)
     else:
-        # thresholds can be adjusted; here simple heuristic
-        if e_val <= 500: e = 1.0
-        elif e_val <= 1200: e = 0.6
-        else: e = 0.2
+        # thresholds can be adjusted (_ENERGY_TH); here simple heuristic
+        e = _ENERGY_VAL[bisect_left(_ENERGY_TH, e_val)]
     # water: liters
     water_val = rec.get("water_liters", None)
     if water_val is None:
         wat = MAP_LVL.get(rec.get("water_level","medium"),0.6)
     else:
-        if water_val <= 2000: wat = 1.0
-        elif water_val <= 5000: wat = 0.6
-        else: wat = 0.2
+        wat = _WATER_VAL[bisect_left(_WATER_TH, water_val)]
     # recycle percent (0..1)
     recycle_pct = rec.get("recycle_percent", None)
     if recycle_pct is None:
         recy = MAP_LVL.get(rec.get("recycle_level","medium"),0.6)
     else:
-        if recycle_pct >= 0.6: recy = 1.0
-        elif recycle_pct >= 0.3: recy = 0.6
-        else: recy = 0.2
+        recy = _RECYCLE_VAL[bisect_right(_RECYCLE_TH, recycle_pct)]
     # carbon: kgCO2
     carbon = rec.get("carbon_kg", None)
     if carbon is None:
         carb = 0.6
     else:
-        if carbon <= 500: carb = 1.0
-        elif carbon <= 1200: carb = 0.6
-        else: carb = 0.2
+        carb = _CARBON_VAL[bisect_left(_CARBON_TH, carbon)]
     # oil handling: boolean (delivered to gestor)
     oil_ok = 1.0 if rec.get("oil_delivered", False) else 0.2
     # hygiene score: percent 0..1
@@ -117,70 +253,141 @@ def compute_score_full(rec, weights=None):
     if hygiene_pct is None:
         hyg = 0.6
     else:
-        if hygiene_pct >= 0.9: hyg = 1.0
-        elif hygiene_pct >= 0.7: hyg = 0.6
-        else: hyg = 0.2
+        hyg = _HYGIENE_VAL[bisect_right(_HYGIENE_TH, hygiene_pct)]
 
     score = (weights["waste"]*w + weights["energy"]*e + weights["water"]*wat +
              weights["recycle"]*recy + weights["carbon"]*carb + weights["oil"]*oil_ok + weights["hygiene"]*hyg) * 100
     return round(score,1)
 
+# vectorized scorer: same rules as compute_score_full, one pass over a list of records.
+# the per-record column builders bind np.nan / MAP_LVL.get as defaults so the
+# comprehension reads a local instead of a global + attribute lookup per item
+def _num_col(records, key, _nan=np.nan):
+    return np.array([_nan if r.get(key) is None else r[key] for r in records], dtype=float)
+
+def _lvl_col(records, key, _lvl=MAP_LVL.get):
+    return np.array([_lvl(r.get(key,"medium"),0.6) for r in records], dtype=float)
+
+def _ladder(th, vals, x, side):
+    return np.take(vals, np.searchsorted(th, x, side=side))
+
+def compute_scores_vec(records, weights=None):
+    if weights is None:
+        weights = DEFAULT_WEIGHTS
+    if not records:
+        return np.empty(0)
+    w = _lvl_col(records, "waste_level")
+    energy = _num_col(records, "energy_kwh")
+    e = np.where(np.isnan(energy), _lvl_col(records, "energy_level"),
+                 _ladder(_ENERGY_TH, _ENERGY_VAL, energy, "left"))
+    water = _num_col(records, "water_liters")
+    wat = np.where(np.isnan(water), _lvl_col(records, "water_level"),
+                   _ladder(_WATER_TH, _WATER_VAL, water, "left"))
+    recycle = _num_col(records, "recycle_percent")
+    recy = np.where(np.isnan(recycle), _lvl_col(records, "recycle_level"),
+                    _ladder(_RECYCLE_TH, _RECYCLE_VAL, recycle, "right"))
+    carbon = _num_col(records, "carbon_kg")
+    carb = np.where(np.isnan(carbon), 0.6,
+                    _ladder(_CARBON_TH, _CARBON_VAL, carbon, "left"))
+    oil_ok = np.array([1.0 if r.get("oil_delivered", False) else 0.2 for r in records])
+    hygiene = _num_col(records, "hygiene_pct")
+    hyg = np.where(np.isnan(hygiene), 0.6,
+                   _ladder(_HYGIENE_TH, _HYGIENE_VAL, hygiene, "right"))
+    factors = np.vstack([w, e, wat, recy, carb, oil_ok, hyg])
+    wv = np.array([weights[k] for k in ("waste","energy","water","recycle","carbon","oil","hygiene")])
+    return np.round(wv @ factors * 100, 1)
+
 def level_from_score(s):
-    if s >= 76: return "Oro"
-    if s >= 41: return "Plata"
-    return "Bronce"
+    return _LEVELS[bisect_right(_LEVEL_TH, s)]
 
 # ---------- Visual helpers ----------
-def plot_trend_scores(sede):
-    months = [r["month"] for r in sede["registros"]]
-    scores = [compute_score_full(r) for r in sede["registros"]]
-    if not months:
-        return None
-    fig, ax = plt.subplots(figsize=(6,2.2))
+# chart rendered to PNG bytes and cached on its inputs, so reruns from unrelated widgets
+# skip the rebuild; sessions share immutable bytes, never a matplotlib Figure (not thread-safe).
+# Built with the OO Figure API: never registered in pyplot, so nothing to plt.close()
+@st.cache_data(show_spinner=False, max_entries=32)
+def _plot_trend(months, scores):
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(6,2.2))
+    ax = fig.add_subplot(111)
     ax.plot(months, scores, marker='o', color="#2d6a4f", linewidth=2)
     ax.set_ylim(0,100)
     ax.set_ylabel("Score")
     ax.grid(alpha=0.2)
-    plt.xticks(rotation=30)
-    plt.tight_layout()
-    return fig
+    ax.tick_params(axis="x", labelrotation=30)
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=200, bbox_inches="tight")  # same defaults as st.pyplot
+    return buf.getvalue()
+
+def plot_trend_scores(sede):
+    months = [r["month"] for r in sede["registros"]]
+    if not months:
+        return None
+    return _plot_trend(tuple(months), tuple(r["score"] for r in sede["registros"]))
 
 def df_from_sede(sede):
-    rows=[]
-    for r in reversed(sede["registros"][-12:]):
-        rows.append({
-            "Mes": r["month"],
-            "Score": compute_score_full(r),
-            "kWh": r.get("energy_kwh") or r.get("energy_level"),
-            "Agua(L)": r.get("water_liters") or r.get("water_level"),
-            "Recycle%": r.get("recycle_percent") or r.get("recycle_level"),
-            "Oil(L)": r.get("oil_liters",0),
-            "Higiene%": r.get("hygiene_pct") or "-",
-            "Evid": "Sí" if r.get("evidence") else "No",
-            "ID": r["id"]
-        })
-    return pd.DataFrame(rows)
-
-# ---------- Utility: zip evidences ----------
+    # dict-of-columns: one pd.DataFrame call instead of the from-records path
+    recs = sede["registros"][-1:-13:-1]  # last 12, newest first, in one slice
+    return pd.DataFrame({
+        "Mes": [r["month"] for r in recs],
+        "Score": [r["score"] for r in recs],
+        "kWh": [r.get("energy_kwh") or r.get("energy_level") for r in recs],
+        "Agua(L)": [r.get("water_liters") or r.get("water_level") for r in recs],
+        "Recycle%": [r.get("recycle_percent") or r.get("recycle_level") for r in recs],
+        "Oil(L)": [r.get("oil_liters",0) for r in recs],
+        "Higiene%": [r.get("hygiene_pct") or "-" for r in recs],
+        "Evid": ["Sí" if r.get("evidence") else "No" for r in recs],
+        "ID": [r["id"] for r in recs]
+    })
+
+# sidebar KPIs (sedes, registros, score avg), recomputed only when the DB changes
+@st.cache_data(show_spinner=False, max_entries=1)
+def _sidebar_stats(mtime):
+    sedes = load_data()["sedes"]
+    scores = np.fromiter((r["score"] for s in sedes.values() for r in s["registros"]), dtype=float)
+    n_regs = int(sum(len(s["registros"]) for s in sedes.values()))
+    return len(sedes), n_regs, round(float(scores.mean()),1) if scores.size else "-"
+
+# ---------- Utility: evidences ----------
+def save_upload(up, path, chunk=1<<20):
+    # stream to disk in 1 MiB blocks (no full getbuffer() copy) and hash along the way
+    h = hashlib.blake2b(digest_size=16)
+    up.seek(0)
+    with open(path, "wb") as f:
+        for block in iter(lambda: up.read(chunk), b""):
+            h.update(block)
+            f.write(block)
+    return h.hexdigest()
+
+# ZIP bytes built in memory and cached on the (path, mtime) signature of the evidences:
+# each signature owns its own bytes, so no shared file on disk can go stale between signatures.
+# cache_resource hands out the immutable bytes without a per-rerun copy; archives can be
+# large, so only a couple are kept
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _build_zip(sig):
+    buf = io.BytesIO()
+    # jpg/png/pdf are already compressed: store them as-is instead of deflating again
+    with zipfile.ZipFile(buf, 'w', compression=zipfile.ZIP_STORED) as zf:
+        for f,_ in sig:
+            zf.write(f, arcname=os.path.basename(f))
+    return buf.getvalue()
+
 def zip_evidences_for_sede(sede_key):
-    files = []
-    sede = data["sedes"][sede_key]
-    for r in sede["registros"]:
-        if r.get("evidence"):
-            files.append(r["evidence"])
-    if not files:
+    files = [r["evidence"] for r in data["sedes"][sede_key]["registros"] if r.get("evidence")]
+    sig = tuple((f, os.path.getmtime(f)) for f in files if os.path.exists(f))
+    if not sig:
         return None
-    zipname = f"{sede_key}_evidencias_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
-    with zipfile.ZipFile(zipname, 'w') as zf:
-        for f in files:
-            if os.path.exists(f):
-                zf.write(f, arcname=os.path.basename(f))
-    return zipname
+    return _build_zip(sig)
 
 # ---------- Certificate PDF (better layout) ----------
 def create_certificate_pdf(record, sede_name, nivel, out_path):
     if not REPORTLAB_AVAILABLE:
         return False, "reportlab no instalado"
+    try:
+        from reportlab.lib.pagesizes import letter
+        from reportlab.pdfgen import canvas
+    except Exception:  # installed but broken: same outcome as missing
+        return False, "reportlab no instalado"
     c = canvas.Canvas(out_path, pagesize=letter)
     # header
     c.setFillColorRGB(0.17,0.42,0.31)  # verde
@@ -192,7 +399,7 @@ def create_certificate_pdf(record, sede_name, nivel, out_path):
     c.drawString(36,735, f"Sede: {sede_name}")
     c.setFillColorRGB(0,0,0)
     c.drawString(36,700, f"Nivel: {nivel}")
-    c.drawString(36,680, f"Score: {compute_score_full(record)}")
+    c.drawString(36,680, f"Score: {record['score']}")
     c.drawString(36,660, f"Fecha emisión: {datetime.now().strftime('%d/%m/%Y %H:%M')}")
     c.drawString(36,640, "Emitido por: Inspector (Demo)")
     c.save()
@@ -200,7 +407,7 @@ def create_certificate_pdf(record, sede_name, nivel, out_path):
 
 # ---------- Start app ----------
 ensure_files()
-data = load_data()
+data = session_data()
 certs = load_certs()
 
 # Header
@@ -218,14 +425,9 @@ st.sidebar.header("Menú")
 role = st.sidebar.radio("Entrar como", ["Empresa (Domino's)","Estado (Inspector)"])
 st.sidebar.markdown("---")
 # compute global stats
-all_sedes = data["sedes"]
-scores_all=[]
-for s in all_sedes.values():
-    for r in s["registros"]:
-        scores_all.append(compute_score_full(r))
-avg_score = round(sum(scores_all)/len(scores_all),1) if scores_all else "-"
-st.sidebar.markdown(f"<div class='kpi'><strong>🏷️ Sedes:</strong><br>{len(all_sedes)}</div>", unsafe_allow_html=True)
-st.sidebar.markdown(f"<div class='kpi' style='margin-top:8px'><strong>📄 Registros:</strong><br>{sum(len(s['registros']) for s in all_sedes.values())}</div>", unsafe_allow_html=True)
+n_sedes, n_regs, avg_score = _sidebar_stats(os.path.getmtime(DB_FILE))
+st.sidebar.markdown(f"<div class='kpi'><strong>🏷️ Sedes:</strong><br>{n_sedes}</div>", unsafe_allow_html=True)
+st.sidebar.markdown(f"<div class='kpi' style='margin-top:8px'><strong>📄 Registros:</strong><br>{n_regs}</div>", unsafe_allow_html=True)
 st.sidebar.markdown(f"<div class='kpi' style='margin-top:8px'><strong>📊 Score avg:</strong><br>{avg_score}</div>", unsafe_allow_html=True)
 
 if role == "Estado (Inspector)":
@@ -293,12 +495,20 @@ def empresa_view():
     ev_cat = st.selectbox("Categoría de evidencia:", ["general","residuos","aceite","factura_proveedor","higiene"])
     up = st.file_uploader("Subir evidencia (foto/pdf):", type=["png","jpg","jpeg","pdf"])
     ev_path = None
+    ev_sha = None
     if up:
-        fn = f"{sel}_{ev_cat}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{up.name}"
-        path = os.path.join(EVID_DIR, fn)
-        with open(path, "wb") as f:
-            f.write(up.getbuffer())
-        ev_path = path
+        # the uploader keeps the file across reruns: copy it once per (upload, sede, category)
+        # and reuse the saved (path, sha) afterwards
+        key = (up.file_id, sel, ev_cat)
+        saved = st.session_state.get("_evidence_saved")
+        if saved and saved[0] == key and os.path.exists(saved[1]):
+            _, ev_path, ev_sha = saved
+        else:
+            fn = f"{sel}_{ev_cat}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{up.name}"
+            path = os.path.join(EVID_DIR, fn)
+            ev_sha = save_upload(up, path)
+            ev_path = path
+            st.session_state["_evidence_saved"] = (key, ev_path, ev_sha)
         st.success("Evidencia guardada ✅")
     st.markdown("</div>", unsafe_allow_html=True)
 
@@ -323,10 +533,13 @@ def empresa_view():
             "carbon_kg": carbon_est,
             "practices": {"cajas_biodegradables": True},  # placeholder
             "evidence": ev_path,
+            "evidence_sha": ev_sha,
             "created_at": datetime.now().isoformat()
         }
+        rec["score"] = compute_score_full(rec)
+        insert_record(sel, rec)
         sede["registros"].append(rec)
-        save_data(data)
+        data["by_id"][rec["id"]] = rec
         st.success("Registro guardado (completo).")
         st.experimental_rerun()
 
@@ -337,19 +550,22 @@ def empresa_view():
     if not df.empty:
         st.dataframe(df, use_container_width=True)
         sel_id = st.selectbox("Selecciona ID para ver/editar:", df["ID"].tolist())
-        rec_obj = next((r for r in sede["registros"] if r["id"]==sel_id), None)
+        rec_obj = data["by_id"].get(sel_id)
         if rec_obj:
             st.markdown("<div class='card'>", unsafe_allow_html=True)
             st.markdown("### ✏️ Ver detalles")
             st.write(rec_obj)
             if st.button("Marcar aceite como entregado al gestor (comprobante)"):
-                rec_obj["oil_delivered"] = True
-                save_data(data)
+                # write first, then touch the session copy: a failed write leaves it matching the DB
+                updated = dict(rec_obj, oil_delivered=True)
+                updated["score"] = compute_score_full(updated)
+                save_record(sel, updated)
+                rec_obj.update(updated)
                 st.success("Marcado como entregado.")
                 st.experimental_rerun()
             if st.button("Eliminar registro"):
-                sede["registros"] = [r for r in sede["registros"] if r["id"]!=sel_id]
-                save_data(data)
+                delete_record(sel_id)
+                sede["registros"].remove(data["by_id"].pop(sel_id))
                 st.success("Registro eliminado.")
                 st.experimental_rerun()
             st.markdown("</div>", unsafe_allow_html=True)
@@ -357,20 +573,19 @@ def empresa_view():
         st.info("Sin registros aún para esta sede.")
 
     # Trend chart
-    fig = plot_trend_scores(sede)
-    if fig:
+    png = plot_trend_scores(sede)
+    if png:
         st.markdown("<div class='card'>", unsafe_allow_html=True)
         st.subheader("📈 Tendencia de Score")
-        st.pyplot(fig)
+        st.image(png, width="stretch")
         st.markdown("</div>", unsafe_allow_html=True)
 
     # Export evidences zip
     st.markdown("---")
     st.subheader("📁 Exportar evidencias")
-    zipfile_path = zip_evidences_for_sede(sel)
-    if zipfile_path:
-        with open(zipfile_path,"rb") as f:
-            st.download_button("📥 Descargar evidencias (ZIP)", f, file_name=zipfile_path)
+    zip_bytes = zip_evidences_for_sede(sel)
+    if zip_bytes:
+        st.download_button("📥 Descargar evidencias (ZIP)", zip_bytes, file_name=f"{sel}_evidencias.zip")
     else:
         st.info("No hay evidencias para comprimir.")
 
@@ -379,7 +594,7 @@ def empresa_view():
     st.subheader("⚠️ Alertas automáticas")
     last = sede["registros"][-1] if sede["registros"] else None
     if last:
-        score = compute_score_full(last)
+        score = last["score"]
         if not last.get("temp_ok"):
             st.error("Temperaturas fuera de rango! Revisar refrigeración.")
         if last.get("oil_liters",0) > 20 and not last.get("oil_delivered"):
@@ -392,17 +607,29 @@ def empresa_view():
         st.info("Sin registros — crea uno para activar alertas.")
 
 # ---------- Estado view ----------
+# certificate history table + encoded CSV, rebuilt only when the certificates file changes
+@st.cache_data(show_spinner=False, max_entries=1)
+def _certs_table(mtime):
+    df = pd.DataFrame(load_certs())
+    return df, df.to_csv(index=False).encode("utf-8")
+
 def estado_view():
     st.subheader("🏛️ Panel Estado — Supervisión completa")
     # Table overview
-    rows=[]
-    for key,s in data["sedes"].items():
-        last = s["registros"][-1] if s["registros"] else None
-        score = compute_score_full(last) if last else None
-        level = level_from_score(score) if last else "Sin datos"
-        rows.append({"id":key,"Sede":s["nombre"],"Municipio":s["municipio"],"Último mes": last["month"] if last else "-", "Score":score or "-", "Nivel":level})
-    df_ov = pd.DataFrame(rows).sort_values(by="Score", ascending=False, na_position="last")
-    st.dataframe(df_ov, use_container_width=True)
+    sedes = data["sedes"]
+    lasts = [s["registros"][-1] if s["registros"] else None for s in sedes.values()]
+    # float column (NaN = no data) so the sort is numeric; "-" is applied only for display
+    scores = np.array([last["score"] if last else np.nan for last in lasts], dtype=float)
+    ov_scores = dict(zip(sedes, scores.tolist()))  # reused by the review block below
+    df_ov = pd.DataFrame({
+        "id": list(sedes.keys()),
+        "Sede": [s["nombre"] for s in sedes.values()],
+        "Municipio": [s["municipio"] for s in sedes.values()],
+        "Último mes": [last["month"] if last else "-" for last in lasts],
+        "Score": scores,
+        "Nivel": [level_from_score(score) if last else "Sin datos" for score,last in zip(scores,lasts)]
+    }).sort_values(by="Score", ascending=False, na_position="last")
+    st.dataframe(df_ov.style.format({"Score": "{:.1f}"}, na_rep="-"), use_container_width=True)
 
     st.markdown("---")
     st.markdown("### 🔎 Revisar y emitir sello")
@@ -410,7 +637,7 @@ def estado_view():
     sede = data["sedes"][sel]
     if sede["registros"]:
         last = sede["registros"][-1]
-        score = compute_score_full(last)
+        score = ov_scores[sel]
         nivel = level_from_score(score)
         color = {"Oro":"#ffd700","Plata":"#adb5bd","Bronce":"#c08457"}[nivel]
         st.markdown(f"<div class='card'><h3>🏅 {sede['nombre']}</h3><p><strong>Mes:</strong> {last['month']} &nbsp; <strong>Score:</strong> {score} &nbsp; <strong>Nivel:</strong> <span style='color:{color}'>{nivel}</span></p><div style='background:#e6e6e6;border-radius:10px;height:16px;'><div style='width:{score}%;background:{color};height:16px;border-radius:10px;'></div></div></div>", unsafe_allow_html=True)
@@ -447,11 +674,13 @@ def estado_view():
     st.markdown("---")
     st.subheader("📜 Historial Sellos")
     if certs:
-        st.dataframe(pd.DataFrame(certs))
-        csv = pd.DataFrame(certs).to_csv(index=False).encode("utf-8")
+        df_certs, csv = _certs_table(os.path.getmtime(CERT_FILE))
+        st.dataframe(df_certs)
         st.download_button("📥 Descargar historial sellos (CSV)", csv, "sellos.csv", "text/csv")
     else:
         st.info("No hay sellos emitidos aún.")
+    if st.button("Preparar exportación de datos (JSON)"):
+        st.download_button("📥 Exportar datos de sedes (JSON)", export_data_json(), DATA_FILE, "application/json")
 
 # Main routing
 if role == "Empresa (Domino's)":